@@ -1,4 +1,10 @@
 import traceback
+import mmap
+import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from array import array
 
 # DOC
 # https://gbdev.gg8.se/wiki/articles/The_Cartridge_Header
@@ -22,6 +28,118 @@ L_GCHCK = (0x14E, 0x14F)
 HEADER_END = L_GCHCK[1]+1
 KILOBYTE = 1024
 MEGABYTE = KILOBYTE*KILOBYTE
+BANK_SIZE = 16*KILOBYTE
+SAVE_CHUNK = 64*KILOBYTE
+MBC2_SAVE_SIZE = 512 # the 512 half-bytes of the MBC2 are stored one per byte by emulators
+MBC2_PACKED_SAVE_SIZE = 256 # or two per byte
+RTC_FOOTER_SIZES = (44, 48) # emulators append the RTC state to MBC3+TIMER saves
+
+# https://gbdev.io/pandocs/CPU_Instruction_Set.html
+# instruction size in bytes, indexed by opcode (illegal opcodes count as 1 byte)
+OPCODE_LENGTH = bytes([
+#   x0 x1 x2 x3 x4 x5 x6 x7 x8 x9 xA xB xC xD xE xF
+    1, 3, 1, 1, 1, 1, 2, 1, 3, 1, 1, 1, 1, 1, 2, 1, # 0x
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1, # 1x
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1, # 2x
+    2, 3, 1, 1, 1, 1, 2, 1, 2, 1, 1, 1, 1, 1, 2, 1, # 3x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 4x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 5x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 6x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 7x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 8x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 9x
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # Ax
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, # Bx
+    1, 1, 3, 3, 3, 1, 2, 1, 1, 1, 3, 2, 3, 3, 2, 1, # Cx
+    1, 1, 3, 1, 3, 1, 2, 1, 1, 1, 3, 1, 3, 1, 2, 1, # Dx
+    2, 1, 1, 1, 1, 1, 2, 1, 2, 1, 3, 1, 1, 1, 2, 1, # Ex
+    2, 1, 1, 1, 1, 1, 2, 1, 2, 1, 3, 1, 1, 1, 2, 1  # Fx
+])
+
+# machine cycles (1 M-cycle = 4 clock cycles) per opcode, conditional branches are counted as not taken
+# illegal opcodes lock the CPU and are counted as 1
+OPCODE_CYCLES = bytes([
+#   x0 x1 x2 x3 x4 x5 x6 x7 x8 x9 xA xB xC xD xE xF
+    1, 3, 2, 2, 1, 1, 2, 1, 5, 2, 2, 2, 1, 1, 2, 1, # 0x
+    1, 3, 2, 2, 1, 1, 2, 1, 3, 2, 2, 2, 1, 1, 2, 1, # 1x
+    2, 3, 2, 2, 1, 1, 2, 1, 2, 2, 2, 2, 1, 1, 2, 1, # 2x
+    2, 3, 2, 2, 3, 3, 3, 1, 2, 2, 2, 2, 1, 1, 2, 1, # 3x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # 4x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # 5x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # 6x
+    2, 2, 2, 2, 2, 2, 1, 2, 1, 1, 1, 1, 1, 1, 2, 1, # 7x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # 8x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # 9x
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # Ax
+    1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 2, 1, # Bx
+    2, 3, 3, 4, 3, 4, 2, 4, 2, 4, 3, 2, 3, 6, 2, 4, # Cx
+    2, 3, 3, 1, 3, 4, 2, 4, 2, 4, 3, 1, 3, 1, 2, 4, # Dx
+    3, 3, 2, 1, 1, 4, 2, 4, 4, 1, 4, 1, 1, 1, 2, 4, # Ex
+    3, 3, 2, 1, 1, 4, 2, 4, 3, 2, 4, 1, 1, 1, 2, 4  # Fx
+])
+# machine cycles of the conditional JR/JP/CALL/RET when the branch is taken
+BRANCH_TAKEN_CYCLES = {
+    0x20: 3, 0x28: 3, 0x30: 3, 0x38: 3, # JR cc
+    0xC2: 4, 0xCA: 4, 0xD2: 4, 0xDA: 4, # JP cc
+    0xC4: 6, 0xCC: 6, 0xD4: 6, 0xDC: 6, # CALL cc
+    0xC0: 5, 0xC8: 5, 0xD0: 5, 0xD8: 5  # RET cc
+}
+OPCODE_CYCLES_TAKEN = bytes(BRANCH_TAKEN_CYCLES.get(op, OPCODE_CYCLES[op]) for op in range(0x100))
+# machine cycles of the CB prefixed instructions, prefix included
+# the (HL) forms take 4, except BIT n HL which takes 3
+CB_CYCLES = bytes((3 if 0x40 <= op < 0x80 else 4) if op & 7 == 6 else 2 for op in range(0x100))
+
+# instructions ending a basic block without falling through: JR, JP, JP HL, RET, RETI
+BRANCH_END = frozenset([0x18, 0xC3, 0xE9, 0xC9, 0xD9])
+# instructions ending a basic block, the execution can continue with the next one
+BRANCH_FALL = frozenset(BRANCH_TAKEN_CYCLES) | frozenset([0xCD, 0xC7, 0xCF, 0xD7, 0xDF, 0xE7, 0xEF, 0xF7, 0xFF])
+# instructions which can close a loop: JR, JR cc, JP, JP cc (CALL and RST return to the caller)
+BRANCH_JUMP = frozenset([0x18, 0x20, 0x28, 0x30, 0x38, 0xC2, 0xC3, 0xCA, 0xD2, 0xDA])
+ILLEGAL_OPCODES = frozenset([0xD3, 0xDB, 0xDD, 0xE3, 0xE4, 0xEB, 0xEC, 0xED, 0xF4, 0xFC, 0xFD])
+ENTRY_POINTS = (L_ENTRY[0], 0x40, 0x48, 0x50, 0x58, 0x60) # entry point and interrupt vectors
+
+# https://gbdev.io/pandocs/Hardware_Reg_List.html
+HARDWARE_REGISTERS = {
+    0x00: "P1",
+    0x01: "SB",
+    0x02: "SC",
+    0x04: "DIV",
+    0x05: "TIMA",
+    0x0F: "IF",
+    0x26: "NR52",
+    0x40: "LCDC",
+    0x41: "STAT",
+    0x44: "LY",
+    0x4D: "KEY1",
+    0x55: "HDMA5",
+    0xFF: "IE"
+}
+
+REGISTER_NAMES = ("B", "C", "D", "E", "H", "L", "HL", "A")
+ALU_NAMES = ("ADD A", "ADC A", "SUB A", "SBC A", "AND A", "XOR A", "OR A", "CP A")
+OPCODE_NAME = [
+    "NOP", "LD BC n16", "LD BC A", "INC BC", "INC B", "DEC B", "LD B n8", "RLCA",
+    "LD a16 SP", "ADD HL BC", "LD A BC", "DEC BC", "INC C", "DEC C", "LD C n8", "RRCA",
+    "STOP", "LD DE n16", "LD DE A", "INC DE", "INC D", "DEC D", "LD D n8", "RLA",
+    "JR e8", "ADD HL DE", "LD A DE", "DEC DE", "INC E", "DEC E", "LD E n8", "RRA",
+    "JR NZ e8", "LD HL n16", "LD HL+ A", "INC HL", "INC H", "DEC H", "LD H n8", "DAA",
+    "JR Z e8", "ADD HL HL", "LD A HL+", "DEC HL", "INC L", "DEC L", "LD L n8", "CPL",
+    "JR NC e8", "LD SP n16", "LD HL- A", "INC SP", "INC HL", "DEC HL", "LD HL n8", "SCF",
+    "JR C e8", "ADD HL SP", "LD A HL-", "DEC SP", "INC A", "DEC A", "LD A n8", "CCF"
+] + [
+    "HALT" if op == 0x76 else "LD {} {}".format(REGISTER_NAMES[(op >> 3) & 7], REGISTER_NAMES[op & 7]) for op in range(0x40, 0x80)
+] + [
+    "{} {}".format(ALU_NAMES[(op >> 3) & 7], REGISTER_NAMES[op & 7]) for op in range(0x80, 0xC0)
+] + [
+    "RET NZ", "POP BC", "JP NZ a16", "JP a16", "CALL NZ a16", "PUSH BC", "ADD A n8", "RST $00",
+    "RET Z", "RET", "JP Z a16", "PREFIX", "CALL Z a16", "CALL a16", "ADC A n8", "RST $08",
+    "RET NC", "POP DE", "JP NC a16", "ILLEGAL", "CALL NC a16", "PUSH DE", "SUB A n8", "RST $10",
+    "RET C", "RETI", "JP C a16", "ILLEGAL", "CALL C a16", "ILLEGAL", "SBC A n8", "RST $18",
+    "LDH a8 A", "POP HL", "LDH C A", "ILLEGAL", "ILLEGAL", "PUSH HL", "AND A n8", "RST $20",
+    "ADD SP e8", "JP HL", "LD a16 A", "ILLEGAL", "ILLEGAL", "ILLEGAL", "XOR A n8", "RST $28",
+    "LDH A a8", "POP AF", "LDH A C", "DI", "ILLEGAL", "PUSH AF", "OR A n8", "RST $30",
+    "LD HL SP + e8", "LD SP HL", "LD A a16", "EI", "ILLEGAL", "ILLEGAL", "CP A n8", "RST $38"
+]
 
 def get_section(rom : bytes, location : tuple) -> bytes:
     return rom[location[0]:location[1]+1]
@@ -127,7 +245,7 @@ def extRamSize(rom : bytes) -> int:
         }.get(get_section(rom, L_RAMSZ)[0], -1) * KILOBYTE
 
 def check_rom(path : str) -> dict:
-    ext_check = path.split('.')[-1]
+    ext_check = path.split('.')[-1].lower()
     if ext_check not in ["gb"]:
         print("Extension for this file is unknown or unsupported")
         return False
@@ -152,6 +270,149 @@ def check_rom(path : str) -> dict:
         print("The above exception occured")
         return {"valid_file":False}
 
+def expected_save_sizes(rom_headers : dict) -> list:
+    size = rom_headers["external_ram"]
+    if size < 0:
+        return []
+    elif "MBC2" in rom_headers["card_type"]:
+        return [MBC2_SAVE_SIZE, MBC2_PACKED_SAVE_SIZE] # extRamSize is in bits for the MBC2
+    elif "TIMER" in rom_headers["card_type"]:
+        return [size] + [size + footer for footer in RTC_FOOTER_SIZES]
+    return [size]
+
+# hash the save content and check if it's blank (only 0x00 or only 0xFF) in a single read
+def hash_save(path : str) -> dict:
+    digest = hashlib.sha1()
+    size = 0
+    fill = None
+    blank = True
+    with open(path, mode="rb") as f:
+        while True:
+            chunk = f.read(SAVE_CHUNK)
+            if len(chunk) == 0:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if blank:
+                if fill is None:
+                    fill = chunk[0]
+                    blank = fill in (0x00, 0xFF)
+                blank = blank and chunk.count(fill) == len(chunk)
+    return {"size": size, "sha1": digest.hexdigest(), "blank": blank and fill is not None}
+
+def check_save(rom_path : str, save_path : str) -> dict:
+    try:
+        rom_headers = check_rom(rom_path)
+        data = {
+            "path": save_path,
+            "rom": rom_path,
+            "expected_size": []
+        }
+        data.update(hash_save(save_path))
+        if "external_ram" in rom_headers:
+            data["expected_size"] = expected_save_sizes(rom_headers)
+        data["valid_size"] = data["size"] in data["expected_size"]
+        return data
+    except Exception as e:
+        print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        print("The above exception occured")
+        return {"path": save_path, "rom": rom_path, "valid_size": False}
+
+# pair every rom with the .sav file of the same name in its folder
+def find_saves(root : str) -> list:
+    pairs = []
+    for folder, dirs, files in os.walk(root):
+        saves = {}
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == ".sav":
+                saves[stem] = name
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == ".gb" and stem in saves:
+                pairs.append((os.path.join(folder, name), os.path.join(folder, saves[stem])))
+    return pairs
+
+def check_saves(root : str, workers : int = None) -> list:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda pair: check_save(*pair), find_saves(root)))
+
+def print_saves(results : list) -> None:
+    for data in results:
+        if "size" not in data:
+            print(data["path"], "ERROR")
+            continue
+        status = []
+        if not data["valid_size"]:
+            status += ["BAD SIZE", data["size"], "expected", data["expected_size"]]
+        if data["blank"]:
+            status.append("BLANK")
+        print(data["path"], *(status if len(status) > 0 else ["OK"]), data["sha1"])
+
+# map every rom under root to its (modification time, size), the folders are read with os.scandir
+# a file failing to stat is skipped, it will be picked up by the next scan
+# the roms of a folder which can't be read are carried over from the previous snapshot, to not report them as removed
+def scan_library(root : str, previous : dict = {}) -> dict:
+    snapshot = {}
+    pending = [root]
+    while len(pending) > 0:
+        folder = pending.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError:
+            prefix = os.path.join(folder, "")
+            for path, state in previous.items():
+                if path.startswith(prefix):
+                    snapshot[path] = state
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.name.split('.')[-1].lower() == "gb":
+                        stat = entry.stat()
+                        snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    pass
+    return snapshot
+
+def diff_snapshot(old : dict, new : dict) -> tuple:
+    added = [path for path in new if path not in old]
+    changed = [path for path, state in new.items() if path in old and old[path] != state]
+    removed = [path for path in old if path not in new]
+    return added, changed, removed
+
+# re-parse the headers of the added and changed roms, and drop the removed ones
+# caches are dicts keyed by rom path (disassembly results for example), their outdated entries are dropped
+def update_index(index : dict, added : list, changed : list, removed : list, caches : tuple = (), workers : int = None) -> None:
+    for path in removed + changed:
+        index.pop(path, None)
+        for cache in caches:
+            cache.pop(path, None)
+    updated = added + changed
+    if len(updated) > 0:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, rom_headers in zip(updated, executor.map(check_rom, updated)):
+                index[path] = rom_headers
+
+# poll the library every interval seconds and keep the header index up to date, until interrupted
+def watch(root : str, index : dict = None, caches : tuple = (), interval : float = 2.0, workers : int = None) -> dict:
+    if index is None:
+        index = {}
+    snapshot = {}
+    try:
+        while True:
+            current = scan_library(root, snapshot)
+            added, changed, removed = diff_snapshot(snapshot, current)
+            if len(added) + len(changed) + len(removed) > 0:
+                update_index(index, added, changed, removed, caches, workers)
+                print(len(added), "added,", len(changed), "changed,", len(removed), "removed,", len(index), "roms indexed")
+            snapshot = current
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return index
 
 def test_read_opcodes(rom_headers : dict) -> dict:
     try:
@@ -162,6 +423,25 @@ def test_read_opcodes(rom_headers : dict) -> dict:
         print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
         print("The above exception occured")
 
+def test_linear_sweep(rom_headers : dict) -> None:
+    try:
+        with map_rom(rom_headers["path"]) as rom:
+            print_sweep(rom, linear_sweep(rom))
+    except Exception as e:
+        print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        print("The above exception occured")
+
+def test_hot_loops(rom_headers : dict) -> dict:
+    try:
+        with open(rom_headers["path"], mode="rb") as f:
+            rom = f.read()
+        blocks = basic_blocks(rom, trace_code(rom))
+        print_blocks(rom, blocks)
+        print_hot_loops(hot_loops(blocks))
+    except Exception as e:
+        print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        print("The above exception occured")
+
 def read_code(rom : bytes, position : int, level = 0, visited = set()) -> int: # https://gbdev.io/pandocs/CPU_Instruction_Set.html
     while position < len(rom) and position not in visited:
         visited.add(position)
@@ -725,10 +1005,196 @@ def read_code(rom : bytes, position : int, level = 0, visited = set()) -> int: #
                 raise Exception("{} {} Unknown opcode {}".format(level, hex(position), rom[position:position+1].hex()))
         position += 1
 
-def run(path : str) -> None:
+def map_rom(path : str) -> mmap.mmap:
+    with open(path, mode="rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# decode every byte of the rom in order, without following the control flow
+# the rom is processed one batch (a bank by default) at a time and the result is returned as columns:
+# "address" (file offset), "opcode" and "length" (instruction size in bytes)
+def linear_sweep(rom : bytes, start : int = 0, end : int = -1, batch : int = BANK_SIZE) -> dict:
+    if end < 0 or end > len(rom):
+        end = len(rom)
+    columns = {
+        "address": array('L'),
+        "opcode": array('B'),
+        "length": array('B')
+    }
+    lengths = OPCODE_LENGTH
+    position = start
+    while position < end:
+        stop = min(position + batch, end)
+        chunk = rom[position:stop]
+        offsets = []
+        i = 0
+        n = len(chunk)
+        while i < n: # the last instruction can overflow into the next batch, it resumes where it ends
+            offsets.append(i)
+            i += lengths[chunk[i]]
+        opcodes = bytes(map(chunk.__getitem__, offsets))
+        columns["address"].extend(map(position.__add__, offsets))
+        columns["opcode"].frombytes(opcodes)
+        columns["length"].frombytes(opcodes.translate(lengths))
+        position += i
+    return columns
+
+def print_sweep(rom : bytes, columns : dict) -> None:
+    for position, opcode, length in zip(columns["address"], columns["opcode"], columns["length"]):
+        if length > 1:
+            print(position // BANK_SIZE, hex(position), OPCODE_NAME[opcode], rom[position+1:position+length].hex())
+        else:
+            print(position // BANK_SIZE, hex(position), OPCODE_NAME[opcode])
+
+# convert a CPU address to a rom offset, the switchable bank is assumed to be the one of the caller (or 1 from bank 0)
+def cpu_to_offset(address : int, bank : int) -> int:
+    if address < BANK_SIZE:
+        return address
+    elif address < 2*BANK_SIZE:
+        return max(bank, 1) * BANK_SIZE + address - BANK_SIZE
+    return -1 # RAM or I/O
+
+# return the rom offset of a static branch target, or -1 if there is none
+def branch_target(rom : bytes, position : int) -> int:
+    opcode = rom[position]
+    if opcode in (0x18, 0x20, 0x28, 0x30, 0x38): # JR
+        return position + 2 + int.from_bytes(rom[position+1:position+2], 'little', signed=True)
+    elif opcode in (0xC2, 0xC3, 0xC4, 0xCA, 0xCC, 0xCD, 0xD2, 0xD4, 0xDA, 0xDC): # JP, CALL
+        return cpu_to_offset(int.from_bytes(rom[position+1:position+3], 'little'), position // BANK_SIZE)
+    elif opcode & 0xC7 == 0xC7: # RST
+        return opcode & 0x38
+    return -1
+
+def instruction_cycles(rom : bytes, position : int, taken : bool = False) -> int:
+    if rom[position] == 0xCB:
+        return CB_CYCLES[rom[position+1]] if position + 1 < len(rom) else 2
+    return (OPCODE_CYCLES_TAKEN if taken else OPCODE_CYCLES)[rom[position]]
+
+# follow the control flow from the given entry points, without recursion
+# return the same columns as linear_sweep, for the reachable code only
+def trace_code(rom : bytes, entries : tuple = ENTRY_POINTS) -> dict:
+    visited = set()
+    pending = list(entries)
+    while len(pending) > 0:
+        position = pending.pop()
+        while 0 <= position < len(rom) and position not in visited:
+            opcode = rom[position]
+            if opcode in ILLEGAL_OPCODES:
+                break
+            visited.add(position)
+            target = branch_target(rom, position)
+            if target >= 0:
+                pending.append(target)
+            if opcode in BRANCH_END:
+                break
+            position += OPCODE_LENGTH[opcode]
+    addresses = sorted(visited)
+    opcodes = bytes(rom[position] for position in addresses)
+    return {
+        "address": array('L', addresses),
+        "opcode": array('B', opcodes),
+        "length": array('B', opcodes.translate(OPCODE_LENGTH))
+    }
+
+# split decoded instructions (see linear_sweep and trace_code) into basic blocks annotated with their cost
+# "cycles" is the cost when the final branch isn't taken, "cycles_taken" when it is
+# "jump_target" is the final branch target if it's a jump (see BRANCH_JUMP), -1 otherwise
+# "polling" lists the hardware registers read in the block, -1 for LDH A C as C isn't known statically
+def basic_blocks(rom : bytes, columns : dict) -> list:
+    leaders = set()
+    for position, opcode, length in zip(columns["address"], columns["opcode"], columns["length"]):
+        if opcode in BRANCH_END or opcode in BRANCH_FALL:
+            leaders.add(position + length)
+            target = branch_target(rom, position)
+            if target >= 0:
+                leaders.add(target)
+    blocks = []
+    block = None
+    for position, opcode, length in zip(columns["address"], columns["opcode"], columns["length"]):
+        if block is None or position in leaders or position != block["end"]:
+            block = {"start": position, "end": position, "instructions": 0, "cycles": 0, "cycles_taken": 0, "target": -1, "jump_target": -1, "polling": []}
+            blocks.append(block)
+        cycles = instruction_cycles(rom, position)
+        block["end"] = position + length
+        block["instructions"] += 1
+        block["cycles"] += cycles
+        block["cycles_taken"] += instruction_cycles(rom, position, True)
+        if opcode == 0xF0: # LDH A a8
+            register = rom[position+1] if position + 1 < len(rom) else -1
+            if register < 0x80 or register == 0xFF: # not HRAM
+                block["polling"].append(register)
+        elif opcode == 0xF2: # LDH A C
+            block["polling"].append(-1)
+        elif opcode == 0xFA: # LD A a16
+            address = int.from_bytes(rom[position+1:position+3], 'little')
+            if address >= 0xFF00 and (address < 0xFF80 or address == 0xFFFF):
+                block["polling"].append(address & 0xFF)
+        if opcode in BRANCH_END or opcode in BRANCH_FALL:
+            block["target"] = branch_target(rom, position)
+            if opcode in BRANCH_JUMP:
+                block["jump_target"] = block["target"]
+            block = None
+    return blocks
+
+# find the loops closed by a backward branch and rank them by estimated cycles per iteration
+# every block between the branch target and the branch is counted once, assuming the inner conditional branches aren't taken
+# called functions aren't included, only the CALL instruction itself
+# a loop is considered to wait on the hardware if the block closing it reads an I/O register,
+# this is an approximation: the compare and branch of the loop aren't checked to actually depend on the value read
+def hot_loops(blocks : list) -> list:
+    starts = {block["start"]: i for i, block in enumerate(blocks)}
+    loops = []
+    for i, block in enumerate(blocks):
+        target = block["jump_target"]
+        if target < 0 or target > block["start"] or target not in starts or target // BANK_SIZE != block["start"] // BANK_SIZE:
+            continue
+        body = blocks[starts[target]:i+1]
+        polling = []
+        for register in block["polling"]:
+            if register not in polling:
+                polling.append(register)
+        loops.append({
+            "start": target,
+            "end": block["end"],
+            "blocks": len(body),
+            "cycles": sum(b["cycles"] for b in body[:-1]) + block["cycles_taken"],
+            "polling": polling
+        })
+    loops.sort(key=lambda loop: loop["cycles"], reverse=True)
+    return loops
+
+def print_blocks(rom : bytes, blocks : list) -> None:
+    for block in blocks:
+        if block["cycles"] != block["cycles_taken"]:
+            print("block", hex(block["start"]), "cycles", block["cycles"], "taken", block["cycles_taken"])
+        else:
+            print("block", hex(block["start"]), "cycles", block["cycles"])
+        position = block["start"]
+        while position < block["end"]:
+            opcode = rom[position]
+            length = OPCODE_LENGTH[opcode]
+            if length > 1:
+                print("   ", hex(position), instruction_cycles(rom, position), OPCODE_NAME[opcode], rom[position+1:position+length].hex())
+            else:
+                print("   ", hex(position), instruction_cycles(rom, position), OPCODE_NAME[opcode])
+            position += length
+
+def print_hot_loops(loops : list) -> None:
+    for loop in loops:
+        if len(loop["polling"]) > 0:
+            registers = ", ".join("$FF00+C" if r < 0 else HARDWARE_REGISTERS.get(r, "$FF{:02X}".format(r)) for r in loop["polling"])
+            print("loop", hex(loop["start"]), hex(loop["end"]), loop["cycles"], "cycles/iteration", "polling", registers)
+        else:
+            print("loop", hex(loop["start"]), hex(loop["end"]), loop["cycles"], "cycles/iteration")
+
+def run(path : str, sweep : bool = False, loops : bool = False) -> None:
     rom_headers = check_rom(path)
     if rom_headers["valid_file"]:
-        test_read_opcodes(rom_headers)
+        if sweep:
+            test_linear_sweep(rom_headers)
+        elif loops:
+            test_hot_loops(rom_headers)
+        else:
+            test_read_opcodes(rom_headers)
 
 if __name__ == "__main__":
     run("Donkey Kong.gb")
\ No newline at end of file